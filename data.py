@@ -0,0 +1,190 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import joblib
+import sklearn
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+ENRICHED_CSV = "Merged_Enriched_Events_CLUSTERED.csv"
+RAW_CSV = "NYC_Service__Volunteer_Opportunities__Historical__20250626.csv"
+INDEX_DIR = "index_cache"
+
+# Only the columns the app reads
+ENRICHED_COLS = [
+    "title", "description", "Mood/Intent", "Topical Theme", "Activity Type",
+    "Effort Estimate", "Postcode", "primary_loc", "locality", "Borough", "Cluster"
+]
+RAW_COLS = ["title", "org_title", "start_date_date", "primary_loc", "Postcode"]
+CATEGORY_COLS = ["Topical Theme", "Activity Type", "Mood/Intent", "Effort Estimate", "Cluster"]
+
+TFIDF_PARAMS = {"stop_words": "english", "max_features": 50_000, "dtype": np.float32}
+
+# === Mood Inference Keywords ===
+MOOD_KEYWORDS = {
+    "Reflect": ["meditate", "journal", "quiet", "contemplation", "healing"],
+    "Connect": ["party", "social", "connect", "meet", "talk"],
+    "Uplift": ["support", "uplift", "inspire", "empower"]
+}
+# One case-insensitive alternation per mood
+MOOD_PATTERNS = {mood: "|".join(map(re.escape, words)) for mood, words in MOOD_KEYWORDS.items()}
+
+# === Disk Cache ===
+def write_atomic(path, write):
+    # Write to a temp file beside the target and rename it into place, so readers never see a partial file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def remove_stale(pattern, keep):
+    # Files from older cache keys are never read again
+    for path in glob.glob(os.path.join(INDEX_DIR, pattern)):
+        if path not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# === Load Event Data ===
+def build_events():
+    enriched = pd.read_csv(ENRICHED_CSV, usecols=ENRICHED_COLS, engine="pyarrow")
+    # Every raw column overlaps an enriched one, so keep the "_y" names the UI expects
+    raw = pd.read_csv(RAW_CSV, usecols=RAW_COLS, engine="pyarrow").add_suffix("_y")
+
+    enriched["description"] = enriched["description"].fillna("")
+    enriched["short_description"] = enriched["description"].str.slice(0, 140) + "..."
+
+    enriched["title_clean"] = enriched["title"].str.strip().str.lower()
+    # Join on a uint64 hash of the normalized title
+    enriched["title_key"] = pd.util.hash_array(enriched["title_clean"].to_numpy())
+    raw["title_key"] = pd.util.hash_array(raw["title_y"].str.strip().str.lower().to_numpy())
+
+    merged = pd.merge(
+        enriched,
+        raw,
+        on="title_key",
+        how="left"
+    )
+
+    # First matching mood wins, same order as MOOD_KEYWORDS
+    mood_masks = [
+        merged["description"].str.contains(pattern, case=False, regex=True)
+        for pattern in MOOD_PATTERNS.values()
+    ]
+    inferred_mood = np.select(mood_masks, list(MOOD_KEYWORDS), default="")
+    has_mood = merged["Mood/Intent"].fillna("").astype(str).str.strip() != ""
+    merged["Mood/Intent"] = merged["Mood/Intent"].where(has_mood, inferred_mood)
+
+    location_cols = [
+        "primary_loc", "primary_loc_y", "locality", "Borough", "City", "Postcode",
+        "Location Name", "Street Address", "Address 1", "Address 2"
+    ]
+    existing_cols = [col for col in location_cols if col in merged.columns]
+    # First non-null location per row, in location_cols order
+    primary_loc = merged[existing_cols[0]].astype(object)
+    for col in existing_cols[1:]:
+        primary_loc = primary_loc.fillna(merged[col].astype(object))
+    merged["primary_loc"] = primary_loc.fillna("Unknown").astype(str)
+
+    title_col = "title" if "title" in merged.columns else "title_clean"
+
+    for col in ["description", "Topical Theme", "Activity Type", "primary_loc", "Postcode", "City"]:
+        if col not in merged.columns:
+            merged[col] = ""
+
+    merged["search_blob"] = (
+        merged[title_col].fillna("").astype(str) + " " +
+        merged["description"].fillna("").astype(str) + " " +
+        merged["Topical Theme"].fillna("").astype(str) + " " +
+        merged["Activity Type"].fillna("").astype(str) + " " +
+        merged["primary_loc"].fillna("").astype(str) + " " +
+        merged["Postcode"].fillna("").astype(str) + " " +
+        merged["City"].fillna("").astype(str)
+    ).str.lower()
+
+    # md5 keeps the ids stored in the feedback file valid
+    id_source = (merged["title"].astype(str) + merged["description"].astype(str)).tolist()
+    merged["event_id"] = [hashlib.md5(text.encode()).hexdigest() for text in id_source]
+
+    # Numeric copy for ZIP prefix filtering as an integer range
+    merged["postcode_int"] = pd.to_numeric(merged["Postcode"], errors="coerce").astype("Int32")
+
+    for col in CATEGORY_COLS:
+        merged[col] = merged[col].astype("category")
+
+    return merged
+
+def events_cache_key():
+    # Any change to the source files or to this module invalidates the processed copy
+    with open(__file__, "rb") as module_file:
+        digest = hashlib.md5(module_file.read())
+    for path in (ENRICHED_CSV, RAW_CSV):
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return digest.hexdigest()[:16]
+
+# One read-only frame shared by all reruns and sessions
+@st.cache_resource
+def get_events():
+    # The processed frame is kept on disk per events_cache_key()
+    cache_path = os.path.join(INDEX_DIR, f"events_{events_cache_key()}.parquet")
+    try:
+        events = pd.read_parquet(cache_path, engine="pyarrow")
+        # Parquet only round-trips string categoricals; integer ones (Cluster) come back plain
+        for col in CATEGORY_COLS:
+            events[col] = events[col].astype("category")
+        return events
+    except Exception:
+        pass  # missing or unreadable, rebuild below
+
+    events = build_events()
+    try:
+        write_atomic(cache_path, lambda path: events.to_parquet(path, engine="pyarrow", compression="zstd"))
+        remove_stale("events_*.parquet", {cache_path})
+    except OSError:
+        pass
+    return events
+
+# === TF-IDF Index ===
+@st.cache_resource
+def get_tfidf():
+    docs = get_events()["search_blob"]
+    # Vectorizer + matrix are kept on disk per corpus, params and sklearn version (the vectorizer is pickled)
+    key_source = "\n".join(docs) + repr(TFIDF_PARAMS) + sklearn.__version__
+    corpus_key = hashlib.md5(key_source.encode()).hexdigest()[:16]
+    vectorizer_path = os.path.join(INDEX_DIR, f"tfidf_{corpus_key}.joblib")
+    matrix_path = os.path.join(INDEX_DIR, f"tfidf_{corpus_key}.npz")
+    try:
+        return joblib.load(vectorizer_path), sparse.load_npz(matrix_path)
+    except Exception:
+        pass  # missing or unreadable, refit below
+
+    vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+    matrix = vectorizer.fit_transform(docs)
+    try:
+        write_atomic(vectorizer_path, lambda path: joblib.dump(vectorizer, path))
+        write_atomic(matrix_path, lambda path: sparse.save_npz(path, matrix))
+        remove_stale("tfidf_*", {vectorizer_path, matrix_path})
+    except OSError:
+        pass
+    return vectorizer, matrix
+
+# === Description Index ===
+@st.cache_resource
+def get_description_index():
+    # Character-trigram inverted index: a literal keyword can only occur in rows holding all of its trigrams
+    counter = CountVectorizer(analyzer="char", ngram_range=(3, 3), binary=True, dtype=np.int8)
+    postings = counter.fit_transform(get_events()["description"]).tocsc()
+    return counter.vocabulary_, postings
@@ -1,14 +1,18 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
-import hashlib
 import os
+import re
+import csv
 from datetime import datetime
-from fuzzywuzzy import fuzz
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from data import get_description_index, get_events, get_tfidf
+
+# Must be the first Streamlit call
+st.set_page_config(page_title="🌱 NYC Community Event Agent")
 
 FEEDBACK_CSV = "feedback_backup.csv"
+FEEDBACK_COLUMNS = ["user", "event_id", "rating", "comment", "timestamp"]
 
 # === Synonym Expansion Map ===
 SYNONYM_MAP = {
@@ -19,82 +23,31 @@ SYNONYM_MAP = {
     "animals": ["pets", "rescue", "dogs", "cats", "shelters"],
     "dogs": ["dogs", "pets", "canines", "puppies", "animal care"]
 }
+# Longest keys first, so each position reports the longest key starting there
+SYNONYM_PATTERN = re.compile(
+    "(?=(" + "|".join(map(re.escape, sorted(SYNONYM_MAP, key=len, reverse=True))) + "))"
+)
+# Shorter keys starting at the same position are prefixes of the reported key
+SYNONYM_PREFIXES = {key: [other for other in SYNONYM_MAP if key.startswith(other)] for key in SYNONYM_MAP}
 
-# === Load Event Data ===
-@st.cache_data
-def load_data():
-    enriched = pd.read_csv("Merged_Enriched_Events_CLUSTERED.csv")
-    raw = pd.read_csv("NYC_Service__Volunteer_Opportunities__Historical__20250626.csv")
-
-    enriched.columns = enriched.columns.str.strip()
-    raw.columns = raw.columns.str.strip()
-
-    enriched["description"] = enriched["description"].fillna("")
-    enriched["short_description"] = enriched["description"].str.slice(0, 140) + "..."
-
-    enriched["title_clean"] = enriched["title"].str.strip().str.lower()
-    raw["title_clean"] = raw["title"].str.strip().str.lower()
-
-    merged = pd.merge(
-        enriched,
-        raw,
-        on="title_clean",
-        how="left",
-        suffixes=("", "_y")
-    )
-
-    def infer_mood(description):
-        desc = str(description).lower()
-        if any(word in desc for word in ["meditate", "journal", "quiet", "contemplation", "healing"]):
-            return "Reflect"
-        if any(word in desc for word in ["party", "social", "connect", "meet", "talk"]):
-            return "Connect"
-        if any(word in desc for word in ["support", "uplift", "inspire", "empower"]):
-            return "Uplift"
-        return ""
-
-    merged["Mood/Intent"] = merged.apply(
-        lambda row: row["Mood/Intent"] if pd.notna(row.get("Mood/Intent")) and row["Mood/Intent"].strip() != ""
-        else infer_mood(row.get("description", "")),
-        axis=1
-    )
-
-    location_cols = [
-        "primary_loc", "primary_loc_y", "locality", "Borough", "City", "Postcode",
-        "Location Name", "Street Address", "Address 1", "Address 2"
-    ]
-    existing_cols = [col for col in location_cols if col in merged.columns]
-    merged["primary_loc"] = merged[existing_cols].bfill(axis=1).iloc[:, 0].fillna("Unknown")
-
-    title_col = "title" if "title" in merged.columns else "title_clean"
-
-    for col in ["description", "Topical Theme", "Activity Type", "primary_loc", "Postcode", "City"]:
-        if col not in merged.columns:
-            merged[col] = ""
-
-    merged["search_blob"] = (
-        merged[title_col].fillna("").astype(str) + " " +
-        merged["description"].fillna("").astype(str) + " " +
-        merged["Topical Theme"].fillna("").astype(str) + " " +
-        merged["Activity Type"].fillna("").astype(str) + " " +
-        merged["primary_loc"].fillna("").astype(str) + " " +
-        merged["Postcode"].fillna("").astype(str) + " " +
-        merged["City"].fillna("").astype(str)
-    ).str.lower()
-
-    return merged
-
-final_df = load_data()
+final_df = get_events()
 
 # === TF-IDF Setup ===
-vectorizer = TfidfVectorizer(stop_words='english')
-tfidf_matrix = vectorizer.fit_transform(final_df["search_blob"])
+vectorizer, tfidf_matrix = get_tfidf()
+
+def top_k_indices(scores, k):
+    # Partition out the top k, then sort just those k (highest first)
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.array([], dtype=int)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
 
 # === Feedback Storage ===
 def ensure_feedback_csv():
     try:
         if not os.path.exists(FEEDBACK_CSV):
-            pd.DataFrame(columns=["user", "event_id", "rating", "comment", "timestamp"]).to_csv(FEEDBACK_CSV, index=False)
+            pd.DataFrame(columns=FEEDBACK_COLUMNS).to_csv(FEEDBACK_CSV, index=False)
         with open(FEEDBACK_CSV, 'a'): pass
     except Exception as e:
         st.session_state.feedback_memory = pd.DataFrame([
@@ -109,11 +62,19 @@ def ensure_feedback_csv():
 ensure_feedback_csv()
 
 # === Feedback Helpers ===
+# Keyed on mtime + size so every append invalidates the cached parse
+@st.cache_data(max_entries=1, show_spinner=False)
+def read_feedback_csv(mtime_ns, size):
+    return pd.read_csv(FEEDBACK_CSV)
+
 def load_feedback():
     try:
-        return pd.read_csv(FEEDBACK_CSV)
+        stat = os.stat(FEEDBACK_CSV)
+        df = read_feedback_csv(stat.st_mtime_ns, stat.st_size)
     except:
-        return st.session_state.get("feedback_memory", pd.DataFrame(columns=["user", "event_id", "rating", "comment", "timestamp"]))
+        df = st.session_state.get("feedback_memory", pd.DataFrame(columns=FEEDBACK_COLUMNS))
+    # Feedback is append-only; the latest row per user/event wins
+    return df.drop_duplicates(subset=["user", "event_id"], keep="last")
 
 def save_feedback(df):
     try:
@@ -122,79 +83,139 @@ def save_feedback(df):
         st.session_state.feedback_memory = df
 
 def store_user_feedback(user, event_id, rating, comment):
-    df = load_feedback()
-    timestamp = datetime.utcnow().isoformat()
-    idx = df[(df.user == user) & (df.event_id == event_id)].index
-    if len(idx):
-        df.loc[idx, ["rating", "comment", "timestamp"]] = [rating, comment, timestamp]
-    else:
-        df = pd.concat([df, pd.DataFrame([{"user": user, "event_id": event_id, "rating": rating, "comment": comment, "timestamp": timestamp}])], ignore_index=True)
-    save_feedback(df)
-
-def get_user_feedback(user, event_id):
-    df = load_feedback()
+    row = [user, event_id, rating, comment, datetime.utcnow().isoformat()]
+    try:
+        write_header = not os.path.exists(FEEDBACK_CSV)
+        with open(FEEDBACK_CSV, "a", newline="") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(FEEDBACK_COLUMNS)
+            writer.writerow(row)
+    except OSError:
+        save_feedback(pd.concat([load_feedback(), pd.DataFrame([row], columns=FEEDBACK_COLUMNS)], ignore_index=True))
+
+def submit_feedback(user, event_id, form_key):
+    # Form on_click callback; widget values are read from session state
+    store_user_feedback(user, event_id, st.session_state[f"{form_key}_rating"], st.session_state[f"{form_key}_comment"])
+    st.toast("✅ Feedback submitted and saved.")
+
+def get_user_feedback(user, event_id, feedback=None):
+    df = load_feedback() if feedback is None else feedback
     row = df[(df.user == user) & (df.event_id == event_id)]
     if not row.empty:
         return int(row.iloc[0].rating), row.iloc[0].comment
     return None, ""
 
-def get_event_average_rating(event_id):
-    df = load_feedback()
-    ratings = df[df.event_id == event_id]["rating"]
-    return round(ratings.mean(), 2) if not ratings.empty else None
+def get_rating_stats(feedback):
+    # {event_id: {"mean": ..., "count": ...}} for every rated event, in one groupby
+    stats = feedback.groupby("event_id")["rating"].agg(["mean", "size"]).rename(columns={"size": "count"})
+    stats["mean"] = stats["mean"].round(2)
+    return stats.to_dict("index")
 
-def get_event_rating_count(event_id):
-    df = load_feedback()
-    return df[df.event_id == event_id].shape[0]
+def get_user_history(user, feedback=None):
+    df = load_feedback() if feedback is None else feedback
+    return df[df.user == user]
 
-def get_user_history(user):
-    return load_feedback()[load_feedback().user == user]
-
-def recommend_similar_events(user, top_n=5):
-    history = get_user_history(user)
+def recommend_similar_events(user, top_n=5, feedback=None):
+    history = get_user_history(user, feedback)
     if history.empty:
         return pd.DataFrame()
-    rated_events = final_df.copy()
-    rated_events["event_id"] = rated_events.apply(lambda row: hashlib.md5((str(row.get("title", "")) + str(row.get("description", ""))).encode()).hexdigest(), axis=1)
-    joined = pd.merge(history, rated_events, on="event_id")
+    joined = pd.merge(history, final_df, on="event_id")
     if joined.empty:
         return pd.DataFrame()
     liked = joined[joined.rating >= 4]
     if liked.empty:
         return pd.DataFrame()
     liked_vec = vectorizer.transform(liked["search_blob"])
-    sim_scores = cosine_similarity(liked_vec, tfidf_matrix).mean(axis=0)
-    indices = sim_scores.argsort()[-top_n:][::-1]
+    # Mean cosine against the liked events == cosine against their mean vector
+    liked_profile = np.asarray(liked_vec.mean(axis=0)).ravel()
+    sim_scores = tfidf_matrix @ liked_profile
+    indices = top_k_indices(sim_scores, top_n)
     return final_df.iloc[indices]
 
 # === Match (Improved) ===
+def category_contains(series, pattern, **kwargs):
+    # Search the few distinct labels once, then select rows by category membership
+    labels = series.cat.categories.astype(str)
+    return series.isin(labels[labels.str.contains(pattern, case=False, **kwargs)])
+
+# Keywords go to str.contains as regexes; only plain literals can be narrowed by trigrams
+REGEX_META = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+def description_candidates(keyword):
+    # Row positions in final_df that may contain keyword, or None if the index can't narrow it down
+    if len(keyword) < 3 or REGEX_META.search(keyword):
+        return None
+    vocabulary, postings = get_description_index()
+    keyword = re.sub(r"\s\s+", " ", keyword)
+    rows = None
+    for gram in {keyword[i:i + 3] for i in range(len(keyword) - 2)}:
+        col = vocabulary.get(gram)
+        if col is None:
+            return np.array([], dtype=int)
+        hits = postings.indices[postings.indptr[col]:postings.indptr[col + 1]]
+        rows = hits if rows is None else np.intersect1d(rows, hits, assume_unique=True)
+    return rows
+
+def description_contains(descriptions, keyword):
+    candidates = description_candidates(keyword)
+    if candidates is None:
+        return descriptions.str.contains(keyword, case=False)
+    mask = np.zeros(len(descriptions), dtype=bool)
+    if len(candidates):
+        mask[candidates] = descriptions.iloc[candidates].str.contains(keyword, case=False).to_numpy()
+    return mask
+
 def keyword_filter(df, keyword):
     keyword = keyword.lower()
     return df[
-        df["Topical Theme"].str.lower().str.contains(keyword) |
-        df["Activity Type"].str.lower().str.contains(keyword) |
-        df["description"].str.lower().str.contains(keyword)
+        category_contains(df["Topical Theme"], keyword) |
+        category_contains(df["Activity Type"], keyword) |
+        description_contains(df["description"], keyword)
     ]
 
-def get_top_matches(query, top_n=50):
-    expanded_terms = [query.lower()]
+def postcode_prefix_mask(postcodes, prefix):
+    # A k-digit prefix of a 5-digit ZIP is the integer range [prefix * 10^(5-k), (prefix + 1) * 10^(5-k))
+    if not prefix:
+        return pd.Series(True, index=postcodes.index)
+    if not (prefix.isascii() and prefix.isdigit()) or len(prefix) > 5:
+        return pd.Series(False, index=postcodes.index)
+    scale = 10 ** (5 - len(prefix))
+    low = int(prefix) * scale
+    return postcodes.between(low, low + scale - 1).fillna(False).astype(bool)
+
+def expand_query(query):
+    query = query.lower()
+    # One regex pass finds the longest key at each position; prefix keys there match too
+    matched = {key for found in SYNONYM_PATTERN.findall(query) for key in SYNONYM_PREFIXES[found]}
+    expanded_terms = [query]
     for key, synonyms in SYNONYM_MAP.items():
-        if key in query.lower():
+        if key in matched:
             expanded_terms += synonyms
-    expanded_query = " ".join(expanded_terms)
+    return " ".join(expanded_terms)
+
+# Cached per query, so reruns reuse the matches
+@st.cache_data(max_entries=128, show_spinner=False)
+def get_top_matches(query, top_n=50):
+    expanded_query = expand_query(query)
 
     keyword_filtered = keyword_filter(final_df, query)
     query_vec = vectorizer.transform([expanded_query])
-    similarity_scores = cosine_similarity(query_vec, tfidf_matrix).flatten()
-    top_indices = similarity_scores.argsort()[-top_n:][::-1]
+    # TF-IDF rows and the query are L2-normalized, so cosine is a sparse dot product
+    similarity_scores = (tfidf_matrix @ query_vec.T).toarray().ravel()
+    top_indices = top_k_indices(similarity_scores, top_n)
     tfidf_filtered = final_df.iloc[top_indices].copy()
     tfidf_filtered["relevance"] = similarity_scores[top_indices]
 
-    combined = pd.concat([keyword_filtered, tfidf_filtered]).drop_duplicates().head(top_n)
+    combined = pd.concat([keyword_filtered, tfidf_filtered]).drop_duplicates(subset="event_id").head(top_n)
     return combined
 
 # === Streamlit UI ===
-st.set_page_config(page_title="🌱 NYC Community Event Agent")
+PAGE_SIZE = 10
+
+def show_more():
+    st.session_state.n_shown += PAGE_SIZE
+
 st.title("🌱 NYC Community Event Agent")
 st.markdown("Choose how you'd like to help and find meaningful events near you.")
 
@@ -214,65 +235,70 @@ intent_input = st.text_input("🙋‍♀️ How can I help?", placeholder="e.g.
 mood_input = st.selectbox("💫 Optional — Set an Intention", ["(no preference)", "Uplift", "Unwind", "Connect", "Empower", "Reflect"])
 zipcode_input = st.text_input("📍 Optional — ZIP Code", placeholder="e.g. 10027")
 
+# The active search lives in session state so it survives reruns (feedback submits, Show more)
 if st.button("Explore"):
     query = intent_input.strip()
     if query:
-        results = get_top_matches(query)
-        if mood_input != "(no preference)":
-            results = results[results["Mood/Intent"].str.contains(mood_input, case=False, na=False)]
-        if zipcode_input:
-            results = results[results["Postcode"].astype(str).str.startswith(zipcode_input.strip())]
-
-        st.subheader(f"🔍 Found {len(results)} matching events")
-
-        for _, row in results.iterrows():
-            with st.container():
-                st.markdown(f"### {row.get('title', 'Untitled Event')}")
-                st.markdown(f"**Organization:** {row.get('org_title_y', 'Unknown')}")
-                st.markdown(f"📍 **Location:** {row.get('primary_loc', 'Unknown')}")
-                st.markdown(f"📅 **Date:** {row.get('start_date_date_y', 'N/A')}")
-                st.markdown(f"🏷️ `{row.get('Topical Theme', '')}` `{row.get('Effort Estimate', '')}` `{row.get('Mood/Intent', '')}`")
-                st.markdown(f"📝 {row.get('short_description', '')}")
-
-                event_id = hashlib.md5((row.get("title", "") + row.get("description", "")).encode()).hexdigest()
-                avg_rating = get_event_average_rating(event_id)
-                count = get_event_rating_count(event_id)
-                if avg_rating is not None:
-                    st.markdown(f"⭐ **Community Rating:** {avg_rating} / 5 ({count} ratings)")
-
-                user_rating, user_comment = get_user_feedback(st.session_state.user, event_id)
-                with st.form(key=f"form_{event_id}_{st.session_state.user}"):
-                    rating = st.slider("Rate this event:", 1, 5, value=user_rating or 3)
-                    comment = st.text_input("Leave feedback:", value=user_comment)
-                    if st.form_submit_button("Submit Feedback"):
-                        store_user_feedback(st.session_state.user, event_id, rating, comment)
-                        st.success("✅ Feedback submitted and saved.")
-
-        recs = recommend_similar_events(st.session_state.user)
-        if not recs.empty:
-            st.markdown("---")
-            st.subheader("🎯 Recommended Events Based on Your Ratings")
-            for _, row in recs.iterrows():
-                st.markdown(f"- **{row.get('title')}** ({row.get('primary_loc', 'Unknown')})")
-
-        history = get_user_history(st.session_state.user)
-        if not history.empty:
-            st.markdown("---")
-            st.subheader("📝 Your Feedback History")
-            st.dataframe(history.sort_values("timestamp", ascending=False).reset_index(drop=True))
+        st.session_state.search = (query, mood_input, zipcode_input.strip())
+        st.session_state.n_shown = PAGE_SIZE
     else:
+        st.session_state.pop("search", None)
         st.warning("Please enter a topic you'd like to help with.")
 
-
-
-
-
-
-
-
-
-
-
-
-
-
+if "search" in st.session_state:
+    query, mood, zipcode = st.session_state.search
+    results = get_top_matches(query)
+    # Mood and ZIP filters as one combined mask
+    keep = np.ones(len(results), dtype=bool)
+    if mood != "(no preference)":
+        keep &= category_contains(results["Mood/Intent"], mood.lower()).to_numpy()
+    if zipcode:
+        keep &= postcode_prefix_mask(results["postcode_int"], zipcode).to_numpy()
+    results = results[keep]
+
+    st.subheader(f"🔍 Found {len(results)} matching events")
+
+    # One feedback read per rerun, shared by every card below
+    feedback = load_feedback()
+    rating_stats = get_rating_stats(feedback)
+
+    # Cards are rendered a page at a time; Show more adds the next page
+    for row in results.head(st.session_state.n_shown).to_dict("records"):
+        with st.container():
+            event_id = row["event_id"]
+            # The card text is a single markdown element
+            card = [
+                f"### {row.get('title', 'Untitled Event')}",
+                f"**Organization:** {row.get('org_title_y', 'Unknown')}",
+                f"📍 **Location:** {row.get('primary_loc', 'Unknown')}",
+                f"📅 **Date:** {row.get('start_date_date_y', 'N/A')}",
+                f"🏷️ `{row.get('Topical Theme', '')}` `{row.get('Effort Estimate', '')}` `{row.get('Mood/Intent', '')}`",
+                f"📝 {row.get('short_description', '')}",
+            ]
+            stats = rating_stats.get(event_id)
+            if stats is not None:
+                card.append(f"⭐ **Community Rating:** {stats['mean']} / 5 ({stats['count']} ratings)")
+            st.markdown("\n\n".join(card))
+
+            user_rating, user_comment = get_user_feedback(st.session_state.user, event_id, feedback)
+            form_key = f"form_{event_id}_{st.session_state.user}"
+            with st.form(key=form_key):
+                st.slider("Rate this event:", 1, 5, value=user_rating or 3, key=f"{form_key}_rating")
+                st.text_input("Leave feedback:", value=user_comment, key=f"{form_key}_comment")
+                st.form_submit_button("Submit Feedback", on_click=submit_feedback, args=(st.session_state.user, event_id, form_key))
+
+    if len(results) > st.session_state.n_shown:
+        st.button("Show more", on_click=show_more)
+
+    recs = recommend_similar_events(st.session_state.user, feedback=feedback)
+    if not recs.empty:
+        st.markdown("---")
+        st.subheader("🎯 Recommended Events Based on Your Ratings")
+        for row in recs.to_dict("records"):
+            st.markdown(f"- **{row.get('title')}** ({row.get('primary_loc', 'Unknown')})")
+
+    history = get_user_history(st.session_state.user, feedback)
+    if not history.empty:
+        st.markdown("---")
+        st.subheader("📝 Your Feedback History")
+        st.dataframe(history.sort_values("timestamp", ascending=False).reset_index(drop=True))